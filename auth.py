@@ -0,0 +1,14 @@
+import hmac
+import os
+from typing import Optional
+
+
+def check_token(provided: Optional[str], env_var: str) -> bool:
+    """
+    Compare a request token against the secret in `env_var`, read at call time so values
+    from .env are honoured. Endpoints guarded this way are disabled while it is unset.
+    """
+    expected = os.getenv(env_var)
+    if not expected or not provided:
+        return False
+    return hmac.compare_digest(provided.encode(), expected.encode())
@@ -0,0 +1,87 @@
+"""
+Benchmark live write latency and event-loop lag while expired chat history is compacted.
+
+Seeds a throwaway database with expired rows, then runs a simulated live session
+(add_message every 5ms, off the loop like main.py does) alongside:
+  - nothing (baseline)
+  - ChatMaintenanceScheduler.run_once (batched, time-bounded deletes)
+  - a single unbatched DELETE (the old clear_old_sessions behaviour)
+
+Usage: python benchmarks/compaction_latency.py [expired_rows]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import ChatDatabase
+from maintenance import ChatMaintenanceScheduler
+
+
+def seed(db_path: str, rows: int):
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO chat_history (session_id, role, content, timestamp) "
+            "VALUES (?, ?, ?, datetime('now', '-30 days'))",
+            [(f"old_{i % 500}", "user", f"old message {i} about acorns and hazelnuts") for i in range(rows)]
+        )
+        conn.commit()
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))] * 1000
+
+
+async def live_session(db: ChatDatabase, stop: asyncio.Event, write_latency: list):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.to_thread(db.add_message, "live", "user", "hello nutsy")
+        write_latency.append(time.perf_counter() - started)
+        await asyncio.sleep(0.005)
+
+
+async def loop_lag(stop: asyncio.Event, lag: list, interval: float = 0.01):
+    while not stop.is_set():
+        expected = time.perf_counter() + interval
+        await asyncio.sleep(interval)
+        lag.append(max(0.0, time.perf_counter() - expected))
+
+
+async def measure(label: str, db: ChatDatabase, work):
+    stop = asyncio.Event()
+    write_latency, lag = [], []
+    tasks = [
+        asyncio.create_task(live_session(db, stop, write_latency)),
+        asyncio.create_task(loop_lag(stop, lag)),
+    ]
+    started = time.perf_counter()
+    await work()
+    duration = time.perf_counter() - started
+    stop.set()
+    await asyncio.gather(*tasks)
+    print(
+        f"{label:10s} {duration:7.2f}s  writes={len(write_latency):5d}  "
+        f"write p50={percentile(write_latency, .5):6.1f}ms p99={percentile(write_latency, .99):6.1f}ms "
+        f"max={max(write_latency) * 1000:7.1f}ms  loop lag max={max(lag) * 1000:6.1f}ms"
+    )
+
+
+async def main(rows: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = ChatDatabase(os.path.join(tmp, "bench.db"))
+        scheduler = ChatMaintenanceScheduler(db, retention_days=7)
+
+        await measure("idle", db, lambda: asyncio.sleep(2))
+        seed(db.db_path, rows)
+        await measure("batched", db, scheduler.run_once)
+        seed(db.db_path, rows)
+        await measure("single", db, lambda: asyncio.to_thread(db.delete_expired_batch, 7, rows))
+
+
+if __name__ == "__main__":
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000))
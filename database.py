@@ -1,14 +1,25 @@
 import sqlite3
+import logging
 from datetime import datetime
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
 
 class ChatDatabase:
     def __init__(self, db_path: str = "chat_history.db"):
         self.db_path = db_path
+        self.fts_enabled = False
         self.init_db()
 
     def init_db(self):
+        """
+        Create the schema. Only cheap, non-blocking steps run here; converting an existing
+        history to incremental auto-vacuum and indexing it for search is done by migrate().
+        """
         with sqlite3.connect(self.db_path) as conn:
+            # Incremental auto-vacuum lets maintenance give pages back in small steps.
+            # It only takes effect without a VACUUM when set before the first table exists.
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
             conn.execute("""
                 CREATE TABLE IF NOT EXISTS chat_history (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -19,6 +30,81 @@ class ChatDatabase:
                 )
             """)
             conn.commit()
+            try:
+                # WAL keeps live writers from being blocked by readers and maintenance
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_chat_history_timestamp ON chat_history (timestamp)"
+                )
+                conn.execute(
+                    "CREATE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history (session_id, timestamp)"
+                )
+                conn.commit()
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Could not enable WAL or create history indexes, continuing without them: {e}")
+            self.fts_enabled = self._init_fts(conn)
+
+    def _init_fts(self, conn: sqlite3.Connection) -> bool:
+        """
+        Enable search if the FTS5 index exists, creating it only for an empty history
+        (where there is nothing to backfill). Returns False if search is unavailable.
+        """
+        try:
+            if self._fts_exists(conn):
+                return True
+            if conn.execute("SELECT 1 FROM chat_history LIMIT 1").fetchone():
+                logger.warning("Chat history search is disabled until the database is migrated (python database.py)")
+                return False
+            self._create_fts(conn)
+            conn.commit()
+            return True
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Chat history search disabled: {e}")
+            return False
+
+    def _fts_exists(self, conn: sqlite3.Connection) -> bool:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_history_fts'"
+        ).fetchone() is not None
+
+    def _create_fts(self, conn: sqlite3.Connection):
+        """Create the FTS5 index over chat_history.content and the triggers that keep it in sync."""
+        conn.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chat_history_fts USING fts5(
+                    content, content='chat_history', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS chat_history_ai AFTER INSERT ON chat_history BEGIN
+                    INSERT INTO chat_history_fts (rowid, content) VALUES (new.id, new.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chat_history_ad AFTER DELETE ON chat_history BEGIN
+                    INSERT INTO chat_history_fts (chat_history_fts, rowid, content)
+                    VALUES ('delete', old.id, old.content);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chat_history_au AFTER UPDATE ON chat_history BEGIN
+                    INSERT INTO chat_history_fts (chat_history_fts, rowid, content)
+                    VALUES ('delete', old.id, old.content);
+                    INSERT INTO chat_history_fts (rowid, content) VALUES (new.id, new.content);
+                END;
+        """)
+
+    def migrate(self):
+        """
+        One-off upgrade of an existing history: switches it to incremental auto-vacuum
+        (a full VACUUM, which rewrites the file) and builds the search index over every
+        stored message. Both hold an exclusive lock for as long as they take, so run this
+        with the app stopped.
+        """
+        with sqlite3.connect(self.db_path) as conn:
+            if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+                logger.info("Switching chat history to incremental auto-vacuum (VACUUM)...")
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                conn.execute("VACUUM")
+            if not self._fts_exists(conn):
+                logger.info("Building chat history search index...")
+                self._create_fts(conn)
+                conn.execute("INSERT INTO chat_history_fts (chat_history_fts) VALUES ('rebuild')")
+                conn.commit()
+        self.fts_enabled = True
 
     def add_message(self, session_id: str, role: str, content: str):
         with sqlite3.connect(self.db_path) as conn:
@@ -37,10 +123,72 @@ class ChatDatabase:
             )
             return [dict(row) for row in cursor.fetchall()]
 
-    def clear_old_sessions(self, days_old: int = 7):
+    def search_messages(self, query: str, session_id: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Full-text search over message content using the FTS5 index, best matches first.
+        The query uses FTS5 syntax (terms, "phrases", prefix*, AND/OR/NOT).
+        """
+        if not self.fts_enabled:
+            raise RuntimeError("Full-text search is not available (FTS5 missing or database not yet migrated)")
+        sql = """
+            SELECT h.*, snippet(chat_history_fts, 0, '[', ']', '...', 12) AS snippet
+            FROM chat_history_fts
+            JOIN chat_history h ON h.id = chat_history_fts.rowid
+            WHERE chat_history_fts MATCH ?
+        """
+        params: List[Any] = [query]
+        if session_id:
+            sql += " AND h.session_id = ?"
+            params.append(session_id)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
         with sqlite3.connect(self.db_path) as conn:
-            conn.execute(
-                "DELETE FROM chat_history WHERE timestamp < datetime('now', ?)",
-                (f'-{days_old} days',)
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute(sql, params)
+            return [dict(row) for row in cursor.fetchall()]
+
+    def delete_expired_batch(self, days_old: int = 7, batch_size: int = 500) -> int:
+        """
+        Delete at most batch_size messages older than days_old in one short transaction.
+        Returns the number of rows deleted so callers can loop until it reaches zero.
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.execute(
+                """
+                DELETE FROM chat_history WHERE id IN (
+                    SELECT id FROM chat_history WHERE timestamp < datetime('now', ?) LIMIT ?
+                )
+                """,
+                (f'-{days_old} days', batch_size)
             )
-            conn.commit()
\ No newline at end of file
+            conn.commit()
+            return cursor.rowcount
+
+    def clear_old_sessions(self, days_old: int = 7, batch_size: int = 500) -> int:
+        total = 0
+        while True:
+            deleted = self.delete_expired_batch(days_old, batch_size)
+            total += deleted
+            if deleted < batch_size:
+                return total
+
+    def incremental_vacuum(self, pages: int = 200):
+        """Return up to `pages` free pages to the filesystem."""
+        with sqlite3.connect(self.db_path) as conn:
+            # incremental_vacuum frees one page per step, so the cursor must be drained
+            conn.execute(f"PRAGMA incremental_vacuum({int(pages)})").fetchall()
+            conn.commit()
+
+    def checkpoint(self) -> Dict[str, int]:
+        """Run a PASSIVE WAL checkpoint, which never waits on active readers or writers."""
+        with sqlite3.connect(self.db_path) as conn:
+            busy, log_frames, checkpointed = conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            return {"busy": busy, "log_frames": log_frames, "checkpointed": checkpointed}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    ChatDatabase().migrate()
+    logger.info("Chat history migration complete")
@@ -0,0 +1,264 @@
+import asyncio
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, List, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+MAX_PROFILE_SECONDS = 30.0
+MIN_PROFILE_INTERVAL = 0.001
+MAX_PROFILE_INTERVAL = 1.0
+
+# Only one sampling profile may run at a time
+_profile_lock = threading.Lock()
+
+LAG_BUCKETS_MS = [1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000]
+
+
+class LoopLagMonitor:
+    """
+    Measures asyncio event-loop lag and reports what was blocking it.
+
+    A sampler task sleeps for `interval` and records how late it woke up into a
+    histogram. A watchdog thread checks the sampler's heartbeat once per interval;
+    when the loop has been stuck longer than the threshold it logs the loop thread's
+    current stack, i.e. the call that is blocking it, once per stall. When the loop
+    resumes, the stall's real duration is filled in. Idle cost is one timer wakeup
+    on the loop and one on the watchdog thread per interval. A stall therefore gets
+    its stack captured once it lasts threshold + interval at most; shorter stalls
+    still show up in the histogram.
+
+    Settings left as None are read from the environment (LOOP_LAG_INTERVAL in seconds,
+    LOOP_LAG_THRESHOLD_MS) when the monitor is built, after load_dotenv() has run.
+    """
+
+    def __init__(self, interval: Optional[float] = None, threshold_ms: Optional[float] = None):
+        if interval is None:
+            interval = float(os.getenv("LOOP_LAG_INTERVAL", "0.25"))
+        if threshold_ms is None:
+            threshold_ms = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))
+        if interval <= 0 or threshold_ms <= 0:
+            raise ValueError("LOOP_LAG_INTERVAL and LOOP_LAG_THRESHOLD_MS must be positive")
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self.bucket_counts = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.last_stall: Optional[Dict[str, Any]] = None
+        self._open_stall: Optional[Dict[str, Any]] = None
+        self._heartbeat = time.monotonic()
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def start(self):
+        if self._task is not None and not self._task.done():
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.create_task(self._sample())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+        logger.info(f"Event loop lag monitor started (threshold {self.threshold * 1000:.0f}ms)")
+
+    async def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def record(self, lag: float):
+        lag_ms = lag * 1000
+        self.bucket_counts[bisect.bisect_left(LAG_BUCKETS_MS, lag_ms)] += 1
+        self.samples += 1
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+    async def _sample(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self._heartbeat = now
+            lag = max(0.0, now - expected)
+            self.record(lag)
+            stall, self._open_stall = self._open_stall, None
+            if stall is not None and lag >= self.threshold:
+                stall["blocked_ms"] = round(lag * 1000, 1)
+                stall["finished"] = True
+            if lag >= self.threshold:
+                # The watchdog already logged this stall as a warning, with the blocking stack
+                logger.debug(f"Event loop lag {lag * 1000:.0f}ms exceeded {self.threshold * 1000:.0f}ms")
+
+    def _watch(self):
+        reported = False
+        while not self._stop.wait(self.interval):
+            stalled_for = time.monotonic() - self._heartbeat - self.interval
+            if stalled_for < self.threshold:
+                reported = False
+                continue
+            if reported:
+                continue
+            reported = True
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else "<loop thread not found>"
+            self.stalls += 1
+            # blocked_ms is the duration so far; the sampler replaces it with the total once the loop resumes
+            self.last_stall = {
+                "detected_at": time.time(),
+                "blocked_ms": round(stalled_for * 1000, 1),
+                "finished": False,
+                "stack": stack,
+            }
+            self._open_stall = self.last_stall
+            logger.warning(
+                f"Event loop blocked for over {stalled_for * 1000:.0f}ms, loop thread stack:\n{stack}"
+            )
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [f"<={b}ms" for b in LAG_BUCKETS_MS] + [f">{LAG_BUCKETS_MS[-1]}ms"]
+        return {
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "samples": self.samples,
+            "mean_lag_ms": round(self.total_lag / self.samples * 1000, 3) if self.samples else 0.0,
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+            "histogram": dict(zip(labels, self.bucket_counts)),
+            "stalls": self.stalls,
+            "last_stall": self.last_stall,
+        }
+
+
+class SessionTaskInventory:
+    """
+    Tracks the tasks, executor futures, threads and in-flight activities of each /ws session
+    so a stuck session can be traced to the piece of work it is waiting on.
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, session_id: str, name: str, **fields):
+        with self._lock:
+            self._sessions.setdefault(session_id, {})[name] = {"started_at": time.time(), **fields}
+
+    def add(self, session_id: str, name: str, task):
+        """Register an asyncio.Task or a future returned by run_in_executor."""
+        self._entry(session_id, name, task=task)
+
+    def bind_thread(self, session_id: str, name: str):
+        """Record the calling thread so its live stack is included in the inventory."""
+        self._entry(session_id, name, thread_id=threading.get_ident(), thread_name=threading.current_thread().name)
+
+    @contextmanager
+    def activity(self, session_id: str, name: str):
+        """Mark an inline awaited step (e.g. TTS) as in flight for the duration of the block."""
+        self._entry(session_id, name, active=True)
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry = self._sessions.get(session_id, {}).get(name)
+                if entry:
+                    entry["active"] = False
+                    entry["finished_at"] = time.time()
+
+    def remove_session(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        frames = sys._current_frames()
+        with self._lock:
+            sessions = {sid: dict(entries) for sid, entries in self._sessions.items()}
+        result = {}
+        for session_id, entries in sessions.items():
+            described = {}
+            for name, entry in entries.items():
+                info: Dict[str, Any] = {"age_s": round(now - entry["started_at"], 3)}
+                task = entry.get("task")
+                if task is not None:
+                    info["state"] = _task_state(task)
+                    if isinstance(task, asyncio.Task) and not task.done():
+                        info["stack"] = [
+                            f"{f.f_code.co_filename}:{f.f_lineno} {f.f_code.co_name}" for f in task.get_stack()
+                        ]
+                if "thread_id" in entry:
+                    frame = frames.get(entry["thread_id"])
+                    info["thread"] = entry["thread_name"]
+                    info["state"] = "running" if frame else "exited"
+                    if frame:
+                        info["stack"] = [line.rstrip() for line in traceback.format_stack(frame)]
+                if "active" in entry:
+                    info["state"] = "running" if entry["active"] else "idle"
+                    if not entry["active"]:
+                        info["last_duration_s"] = round(entry["finished_at"] - entry["started_at"], 3)
+                described[name] = info
+            result[session_id] = described
+        return result
+
+
+def _task_state(task) -> str:
+    if not task.done():
+        return "running"
+    if task.cancelled():
+        return "cancelled"
+    return "failed" if task.exception() else "done"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_profile(duration: float, interval: float = 0.01) -> str:
+    """
+    Sample every thread's stack for `duration` seconds and return the result in
+    collapsed-stack format ("thread;outer;...;inner count" per line), ready for
+    flamegraph.pl or speedscope. Must run off the event loop, e.g. via asyncio.to_thread.
+    Raises RuntimeError if another profile is already running.
+    """
+    duration = min(max(duration, MIN_PROFILE_INTERVAL), MAX_PROFILE_SECONDS)
+    interval = min(max(interval, MIN_PROFILE_INTERVAL), MAX_PROFILE_INTERVAL, duration)
+    if not _profile_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        return _collect_samples(duration, interval)
+    finally:
+        _profile_lock.release()
+
+
+def _collect_samples(duration: float, interval: float) -> str:
+    own_id = threading.get_ident()
+    counts: Counter = Counter()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            counts[";".join(reversed(stack))] += 1
+        time.sleep(min(interval, max(0.0, deadline - time.monotonic())))
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
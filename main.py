@@ -1,7 +1,7 @@
 # AI Voice Agent Backend - Updated for Stable Audible Murf TTS Streaming
 
-from fastapi import FastAPI, UploadFile, File, Request, Path, WebSocket, WebSocketDisconnect, Form
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import FastAPI, UploadFile, File, Request, Path, WebSocket, WebSocketDisconnect, Form, Header
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from dotenv import load_dotenv
@@ -19,7 +19,7 @@ from assemblyai.streaming.v3 import (
     TurnEvent,
 )
 import google.generativeai as genai
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 import logging
 import asyncio
 import queue
@@ -29,10 +29,15 @@ import threading
 import concurrent.futures
 from concurrent.futures import ThreadPoolExecutor
 from database import ChatDatabase
+from maintenance import ChatMaintenanceScheduler
+from diagnostics import LoopLagMonitor, SessionTaskInventory, sample_profile
+from auth import check_token
 from skills import SKILL_FUNCTION_DECLARATIONS, get_current_weather, get_real_time_answer
 from google.generativeai.types import Tool, FunctionDeclaration
 import uuid
 import re
+import math
+from contextlib import asynccontextmanager
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -71,11 +76,23 @@ If you don't know the answer, or if the question involves factual info (recipes,
 Your job is to keep the conversation BOUNCY, FUN, and full of nutty excitement!!! LET’S GO!!! 🐿️💨
 """
 
+# Start and stop background services (history maintenance, loop lag monitor) with the app
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    history_maintenance.start()
+    loop_lag_monitor.start()
+    try:
+        yield
+    finally:
+        await loop_lag_monitor.stop()
+        await history_maintenance.stop()
+
 # App setup
 app = FastAPI(
     title="Nutsy - The Hyperactive Squirrel AI",
     description="A bouncy, energetic, easily-distracted squirrel assistant!",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
@@ -85,6 +102,11 @@ chat_histories: Dict[str, List[Dict[str, Any]]] = {}
 
 # Initialize database
 db = ChatDatabase()
+history_maintenance = ChatMaintenanceScheduler(db)
+
+# Diagnostics: event-loop lag monitor and per-session task inventory
+loop_lag_monitor = LoopLagMonitor()
+session_tasks = SessionTaskInventory()
 
 # Pre-generated fallback audio
 FALLBACK_AUDIO_PATH = "static/fallback.mp3"
@@ -197,7 +219,7 @@ async def stream_llm_response_with_murf_tts(user_text: str, session_id: str, web
     try:
         genai.configure(api_key=GEMINI_API_KEY)
 
-        db.add_message(session_id, "user", user_text)
+        await asyncio.to_thread(db.add_message, session_id, "user", user_text)
         history = chat_histories.get(session_id, [])
 
         tools = [Tool(function_declarations=[
@@ -262,12 +284,13 @@ async def stream_llm_response_with_murf_tts(user_text: str, session_id: str, web
         })
         logger.info(f"Sent assistant_message to frontend: {final_text}")
 
-        db.add_message(session_id, "assistant", final_text)
+        await asyncio.to_thread(db.add_message, session_id, "assistant", final_text)
         chat_histories[session_id] = chat.history
 
         # Call updated TTS to buffer all chunks for frontend full audio assembly and playback
         if text_chunks and MURF_KEY:
-            await murf_websocket_tts_to_client(text_chunks, websocket, STATIC_MURF_CONTEXT)
+            with session_tasks.activity(session_id, "tts"):
+                await murf_websocket_tts_to_client(text_chunks, websocket, STATIC_MURF_CONTEXT)
 
         return final_text
 
@@ -353,6 +376,7 @@ async def websocket_endpoint(websocket: WebSocket):
 
         executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
         def run_streaming_client():
+            session_tasks.bind_thread(session_id, "streaming_client")
             try:
                 streaming_client.stream(audio_iterator)
             except Exception as e:
@@ -413,6 +437,8 @@ async def websocket_endpoint(websocket: WebSocket):
 
         streaming_task = main_loop.run_in_executor(executor, run_streaming_client)
         transcript_task = asyncio.create_task(process_transcripts())
+        session_tasks.add(session_id, "streaming_executor", streaming_task)
+        session_tasks.add(session_id, "process_transcripts", transcript_task)
 
         try:
             while True:
@@ -443,6 +469,7 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         logger.error(f"WebSocket endpoint error: {e}")
     finally:
+        session_tasks.remove_session(session_id)
         if streaming_client:
             try:
                 streaming_client.disconnect(terminate=True)
@@ -451,6 +478,37 @@ async def websocket_endpoint(websocket: WebSocket):
                 logger.error(f"Error disconnecting streaming client: {e}")
 
 
+# --- DIAGNOSTICS ENDPOINTS (require X-Diagnostics-Token matching DIAGNOSTICS_TOKEN) ---
+@app.get("/api/diagnostics")
+async def get_diagnostics(x_diagnostics_token: Optional[str] = Header(None)):
+    """Event-loop lag histogram, last detected stall and the task inventory of every live session"""
+    if not check_token(x_diagnostics_token, "DIAGNOSTICS_TOKEN"):
+        return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+    return {
+        "status": "success",
+        "event_loop": loop_lag_monitor.snapshot(),
+        "sessions": session_tasks.snapshot()
+    }
+
+@app.get("/api/diagnostics/profile")
+async def profile_process(seconds: float = 5.0, interval_ms: float = 10.0, x_diagnostics_token: Optional[str] = Header(None)):
+    """Sample all thread stacks for a bounded time and return collapsed stacks for flamegraph tools"""
+    if not check_token(x_diagnostics_token, "DIAGNOSTICS_TOKEN"):
+        return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+    if not all(math.isfinite(v) and v > 0 for v in (seconds, interval_ms)):
+        return JSONResponse(
+            status_code=400,
+            content={"status": "error", "message": "seconds and interval_ms must be positive numbers"}
+        )
+    try:
+        collapsed = await asyncio.to_thread(sample_profile, seconds, interval_ms / 1000)
+        return PlainTextResponse(collapsed)
+    except RuntimeError as e:
+        return JSONResponse(status_code=409, content={"status": "error", "message": str(e)})
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+
 # --- HEALTH CHECK ENDPOINT ---
 @app.get("/health")
 async def health_check():
@@ -470,6 +528,17 @@ async def health_check():
 async def serve_ui(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+# Full-text search over chat history for support staff (declared before /api/history/{session_id} so it isn't shadowed)
+@app.get("/api/history/search")
+async def search_chat_history(q: str, session_id: Optional[str] = None, limit: int = 50, x_support_token: Optional[str] = Header(None)):
+    if not check_token(x_support_token, "HISTORY_SEARCH_TOKEN"):
+        return JSONResponse(status_code=401, content={"status": "error", "message": "Unauthorized"})
+    try:
+        results = await asyncio.to_thread(db.search_messages, q, session_id, max(1, min(limit, 200)))
+        return {"status": "success", "results": results}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
 # Add endpoint to fetch chat history
 @app.get("/api/history/{session_id}")
 async def get_chat_history(session_id: str):
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+
+from database import ChatDatabase
+
+logger = logging.getLogger(__name__)
+
+
+class ChatMaintenanceScheduler:
+    """
+    Periodically prunes expired chat history without stalling live sessions.
+
+    Each pass deletes expired rows in small batches (one short write transaction each,
+    with a pause in between so add_message calls can interleave), then frees pages with
+    an incremental vacuum and runs a passive WAL checkpoint. Batch size adapts so each
+    delete holds the write lock for roughly `batch_target_ms`. All SQLite work happens
+    in a worker thread so the event loop is never blocked.
+
+    Settings left as None are read from the environment when the scheduler is built,
+    so values from .env are picked up once load_dotenv() has run.
+    """
+
+    def __init__(
+        self,
+        db: ChatDatabase,
+        retention_days: Optional[int] = None,
+        interval: Optional[float] = None,
+        batch_size: Optional[int] = None,
+        batch_pause: Optional[float] = None,
+        vacuum_pages: Optional[int] = None,
+        batch_target_ms: Optional[float] = None,
+    ):
+        self.db = db
+        self.retention_days = retention_days if retention_days is not None else int(os.getenv("HISTORY_RETENTION_DAYS", "7"))
+        self.interval = interval if interval is not None else float(os.getenv("HISTORY_MAINTENANCE_INTERVAL", "600"))
+        self.batch_size = batch_size if batch_size is not None else int(os.getenv("HISTORY_DELETE_BATCH_SIZE", "200"))
+        self.batch_pause = batch_pause if batch_pause is not None else float(os.getenv("HISTORY_BATCH_PAUSE", "0.05"))
+        self.vacuum_pages = vacuum_pages if vacuum_pages is not None else int(os.getenv("HISTORY_VACUUM_PAGES", "200"))
+        self.batch_target = (
+            batch_target_ms if batch_target_ms is not None else float(os.getenv("HISTORY_BATCH_TARGET_MS", "20"))
+        ) / 1000
+        if self.batch_size < 1:
+            raise ValueError("HISTORY_DELETE_BATCH_SIZE must be at least 1")
+        if self.interval <= 0 or self.batch_target <= 0:
+            raise ValueError("HISTORY_MAINTENANCE_INTERVAL and HISTORY_BATCH_TARGET_MS must be positive")
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"Chat history maintenance started (retention {self.retention_days} days, "
+                f"every {self.interval:.0f}s)"
+            )
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def run_once(self) -> int:
+        """Run a single maintenance pass and return the number of rows deleted."""
+        total = 0
+        batch_size = self.batch_size
+        while True:
+            started = time.monotonic()
+            deleted = await asyncio.to_thread(
+                self.db.delete_expired_batch, self.retention_days, batch_size
+            )
+            elapsed = time.monotonic() - started
+            total += deleted
+            if deleted < batch_size:
+                break
+            # Keep each write transaction near the target so live inserts never wait long
+            if elapsed > self.batch_target:
+                batch_size = max(1, batch_size // 2)
+            elif elapsed < self.batch_target / 2:
+                batch_size = min(self.batch_size, batch_size * 2)
+            await asyncio.sleep(self.batch_pause)
+
+        await asyncio.to_thread(self.db.incremental_vacuum, self.vacuum_pages)
+        checkpoint = await asyncio.to_thread(self.db.checkpoint)
+        if total:
+            logger.info(f"Chat history maintenance removed {total} expired messages (checkpoint: {checkpoint})")
+        return total
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in chat history maintenance: {e}")
+            await asyncio.sleep(self.interval)